@@ -25,63 +25,68 @@ Examples:
 """
 import argparse, csv, io, re
 from pathlib import Path
-from typing import List
+from typing import Iterable
 import pandas as pd
 
 POSSIBLE_ENCODINGS = ("utf-8-sig","utf-8","cp1250","iso-8859-2","latin1")
+DELIMITERS = (";",",","\t","|")
+_IMG_SPLIT_RE = re.compile(r"[;|,]\s*")
+
+# constant per-row values; each is broadcast over the whole column
+MAIN_FLAGS = {"LANGUAGE":"sk", "VARIANT_YN":"0", "VARIANT_CODE":"", "MAIN_YN":"", "ACTIVE_YN":"1",
+              "ARCHIVED_YN":"0", "CAN_ADD_TO_BASKET_YN":"1", "IS_PRICES_WITH_VAT_YN":"1",
+              "EAN":"", "STOCK":"", "WEIGHT":""}
+VARIANT_FLAGS = {"VARIANT_YN":"1", "MAIN_YN":"0", "ACTIVE_YN":"1", "ARCHIVED_YN":"",
+                 "CAN_ADD_TO_BASKET_YN":"", "IS_PRICES_WITH_VAT_YN":"1"}
 
 def sniff_delimiter(sample: str) -> str:
-    try:
-        dialect = csv.Sniffer().sniff(sample, delimiters=[",",";","\t","|"])
-        return dialect.delimiter
-    except Exception:
-        return ";" if sample.count(";") >= sample.count(",") else ","
+    # count on the header line: free-text cells (descriptions) are full of commas
+    header = sample.split("\n", 1)[0] or sample
+    counts = {d: header.count(d) for d in DELIMITERS}
+    return max(counts, key=lambda d: (counts[d], d == ";"))
 
 def read_csv_safely(p: Path):
     raw = p.read_bytes()
-    best = None  # (df, enc, delim, penalty, priority)
-    priority = {"utf-8-sig":0,"utf-8":1,"cp1250":2,"iso-8859-2":3,"latin1":4}
+    # first encoding (in priority order) that decodes cleanly wins;
+    # latin1 is last and decodes any byte string, so one always matches
     for enc in POSSIBLE_ENCODINGS:
         try:
             text = raw.decode(enc)
-        except Exception:
-            continue
-        pen = text.count(" ")
-        delim = sniff_delimiter(text[:4096])
-        try:
-            df = pd.read_csv(io.StringIO(text), delimiter=delim, dtype=str).fillna("")
-        except Exception:
+            break
+        except UnicodeDecodeError:
             continue
-        cand = (df, enc, delim, pen, priority.get(enc, 9))
-        if best is None or (pen, cand[4]) < (best[3], best[4]):
-            best = cand
-    if best is None:
-        text = raw.decode("utf-8", errors="replace")
-        delim = sniff_delimiter(text[:4096])
-        df = pd.read_csv(io.StringIO(text), delimiter=delim, dtype=str).fillna("")
-        return df, "utf-8", delim
-    return best[0], best[1], best[2]
+    delim = sniff_delimiter(text[:8192])
+    # na_filter=False keeps empty cells as "" (no NaN scan, no fillna pass)
+    df = pd.read_csv(io.StringIO(text), delimiter=delim, dtype=str, engine="c",
+                     keep_default_na=False, na_filter=False, low_memory=False)
+    return df, enc, delim
 
 def read_any_table(path: str):
     p = Path(path)
     if not p.exists():
         raise FileNotFoundError(path)
     if p.suffix.lower() in (".xlsx", ".xls"):
-        df = pd.read_excel(p, dtype=str).fillna("")
+        engine = "xlrd" if p.suffix.lower() == ".xls" else "openpyxl"
+        df = pd.read_excel(p, dtype=str, engine=engine, na_filter=False)
         return df, "excel", "excel"
     return read_csv_safely(p)
 
 def normalize_header_map(cols):
     m = {}
+    # normalize once; first column wins on duplicate normalized names
+    norm = {}
+    for c in cols:
+        norm.setdefault(c.strip().lower(), c)
+    norm_items = list(norm.items())
     def find(name_variants):
-        for v in name_variants:
-            for c in cols:
-                if c.strip().lower() == v.lower():
-                    return c
-        for v in name_variants:
-            for c in cols:
-                if v.lower() in c.strip().lower():
-                    return c
+        lowered = [v.lower() for v in name_variants]
+        for v in lowered:
+            if v in norm:
+                return norm[v]
+        for v in lowered:
+            for key, orig in norm_items:
+                if v in key:
+                    return orig
         return None
     base_fields = [
         "PRODUCT_CODE","VARIANT_YN","VARIANT_CODE","MAIN_YN","ACTIVE_YN",
@@ -97,28 +102,20 @@ def normalize_header_map(cols):
     m["PARAM_COLS"]  = [c for c in cols if "PARAMETER" in c.upper()]
     return m
 
-def ensure_col(df, col: str):
-    if col and col not in df.columns:
-        df[col] = ""
-
-def merge_images_unique(values: List[str]) -> str:
-    seen, out = set(), []
-    for v in values:
-        if not v: continue
-        for p in re.split(r"[;|,]\s*", str(v).strip()):
-            p = p.strip()
-            if p and p not in seen:
-                seen.add(p); out.append(p)
-    return ";".join(out)
+def merge_images_unique(values: Iterable[str]) -> str:
+    s = pd.Series(values, dtype=object).dropna().astype(str)
+    parts = s.str.split(_IMG_SPLIT_RE).explode().str.strip()
+    return ";".join(parts[parts != ""].drop_duplicates())
 
 def first_image(value: str) -> str:
     if not value: return ""
-    parts = re.split(r"[;|,]\s*", str(value).strip())
+    parts = _IMG_SPLIT_RE.split(str(value).strip())
     return parts[0].strip() if parts else ""
 
-def build_variants(df, param_col: str, parent_code: str, main_title: str = None, template_index: int = 0):
+def build_variants(df, param_col: str, parent_code: str, main_title: str = None, template_index: int = 0,
+                   headers: dict = None):
     cols = list(df.columns)
-    h = normalize_header_map(cols)
+    h = headers or normalize_header_map(cols)
     if not h["PRODUCT_CODE"]:
         raise RuntimeError("Missing [PRODUCT_CODE] header.")
     # fuzzy param match
@@ -127,66 +124,46 @@ def build_variants(df, param_col: str, parent_code: str, main_title: str = None,
         if matches: param_col = matches[0]
     # common PARAMETERs (same across all) → move to MAIN only
     common_param_cols = []
-    for pc in h["PARAM_COLS"]:
-        vals = [str(v).strip() for v in df[pc].tolist() if str(v).strip() != ""]
-        if len(set(vals)) <= 1:
-            common_param_cols.append(pc)
+    if h["PARAM_COLS"]:
+        stripped = df[h["PARAM_COLS"]].apply(lambda s: s.astype(str).str.strip())
+        mask = stripped.replace("", pd.NA).nunique(dropna=True) <= 1
+        common_param_cols = list(dict.fromkeys(mask[mask].index))
 
-    base = df.iloc[template_index].copy()
+    base = df.iloc[[template_index]].copy()
     base[h["PRODUCT_CODE"]] = parent_code
     main_only = [h.get(k) for k in ("TITLE","LONG_DESCRIPTION","SHORT_DESCRIPTION","SEO_URL","SEO_TITLE","SEO_DESCRIPTION",
                                     "MANUFACTURER","AVAILABILITY","AVAILABILITY_NOTE","UNIT","VAT","CATEGORIES")]
-    main_only = [c for c in main_only if c]
-
-    # Ensure presence of flags/price/labels
-    for k in ("VARIANT_YN","VARIANT_CODE","MAIN_YN","ACTIVE_YN","ARCHIVED_YN","CAN_ADD_TO_BASKET_YN","IS_PRICES_WITH_VAT_YN"):
-        ensure_col(df, h.get(k) or f"[{k}]")
-    for c in h["LABEL_COLS"]: ensure_col(df, c)
-    for c in h["PRICE_COLS"]: ensure_col(df, c)
+    # dedup: fuzzy header matching can map two fields to one column (e.g. AVAILABILITY
+    # and AVAILABILITY_NOTE), and .loc with a repeated label would duplicate it
+    main_only = list(dict.fromkeys(c for c in main_only if c))
 
     # MAIN flags
-    if h["LANGUAGE"]: base[h["LANGUAGE"]] = "sk"
-    if h["VARIANT_YN"]: base[h["VARIANT_YN"]] = "0"
-    if h["VARIANT_CODE"]: base[h["VARIANT_CODE"]] = ""
-    if h["MAIN_YN"]: base[h["MAIN_YN"]] = ""
-    if h["ACTIVE_YN"]: base[h["ACTIVE_YN"]] = "1"
-    if h["ARCHIVED_YN"]: base[h["ARCHIVED_YN"]] = "0"
-    if h["CAN_ADD_TO_BASKET_YN"]: base[h["CAN_ADD_TO_BASKET_YN"]] = "1"
-    if h["IS_PRICES_WITH_VAT_YN"]: base[h["IS_PRICES_WITH_VAT_YN"]] = "1"
-    if h["EAN"]: base[h["EAN"]] = ""
-    if h["STOCK"]: base[h["STOCK"]] = ""
-    if h["WEIGHT"]: base[h["WEIGHT"]] = ""
+    for k, v in MAIN_FLAGS.items():
+        if h[k]: base[h[k]] = v
     if param_col: base[param_col] = ""
     if main_title and h["TITLE"]: base[h["TITLE"]] = main_title
-    if h["IMAGES"]: base[h["IMAGES"]] = merge_images_unique(df[h["IMAGES"]].tolist())
+    if h["IMAGES"]: base[h["IMAGES"]] = merge_images_unique(df[h["IMAGES"]])
     for c in h["LABEL_COLS"]: base[c] = "0"
 
-    # VARIANTS
-    variants = []
-    for i, row in df.reset_index(drop=True).iterrows():
-        vr = row.copy()
-        # capture original code FIRST
-        orig_code = row[h["PRODUCT_CODE"]]
-        vr[h["PRODUCT_CODE"]] = parent_code
-        if h["VARIANT_YN"]: vr[h["VARIANT_YN"]] = "1"
-        if h["VARIANT_CODE"]: vr[h["VARIANT_CODE"]] = orig_code  # <-- change requested
-        if h["MAIN_YN"]: vr[h["MAIN_YN"]] = "0"
-        if h["ACTIVE_YN"]: vr[h["ACTIVE_YN"]] = "1"
-        if h["ARCHIVED_YN"]: vr[h["ARCHIVED_YN"]] = ""
-        if h["CAN_ADD_TO_BASKET_YN"]: vr[h["CAN_ADD_TO_BASKET_YN"]] = ""
-        if h["IS_PRICES_WITH_VAT_YN"]: vr[h["IS_PRICES_WITH_VAT_YN"]] = "1"
-        # clear main-only fields
-        for c in main_only: vr[c] = ""
-        # parameters: those that are common move off variants; keep distinguishing one
-        for pc in common_param_cols: vr[pc] = ""
-        # enforce exactly one image per variant
-        if h["IMAGES"]: vr[h["IMAGES"]] = first_image(row[h["IMAGES"]])
-        # labels to 0
-        for c in h["LABEL_COLS"]: vr[c] = "0"
-        variants.append(vr)
-
-    out_rows = [base] + variants
-    out = pd.DataFrame(out_rows, columns=cols)
+    # VARIANTS (whole-column assignments instead of per-row Series)
+    vr = df.copy()
+    vr[h["PRODUCT_CODE"]] = parent_code
+    if h["VARIANT_CODE"]: vr[h["VARIANT_CODE"]] = df[h["PRODUCT_CODE"]].values  # original per-row codes
+    for k, v in VARIANT_FLAGS.items():
+        if h[k]: vr[h[k]] = v
+    # clear main-only fields
+    if main_only: vr.loc[:, main_only] = ""
+    # parameters: those that are common move off variants; keep distinguishing one
+    if common_param_cols: vr.loc[:, common_param_cols] = ""
+    # enforce exactly one image per variant
+    if h["IMAGES"]: vr[h["IMAGES"]] = df[h["IMAGES"]].map(first_image)
+    # labels to 0
+    label_cols = list(dict.fromkeys(h["LABEL_COLS"]))
+    if label_cols: vr.loc[:, label_cols] = "0"
+
+    # project onto the input columns: base may carry an extra column (e.g. an
+    # unmatched --param), and the output must keep exactly the input header
+    out = pd.concat([base, vr], ignore_index=True)[cols]
     return out
 
 def ask(prompt: str, default: str = "") -> str:
@@ -234,16 +211,16 @@ def main():
         t = ask("Title for MAIN product (leave empty to keep first row's TITLE)", main_title)
         if t: main_title = t
 
-    out = build_variants(df, param_col=param_col, parent_code=parent_code, main_title=main_title, template_index=args.template_index)
+    out = build_variants(df, param_col=param_col, parent_code=parent_code, main_title=main_title,
+                         template_index=args.template_index, headers=headers)
 
     base = Path(args.input)
     out_path = args.output or str(base.with_name(base.stem + "_variants" + base.suffix))
 
     out_enc = "utf-8-sig" if args.excel_bom else args.out_encoding
-    if isinstance(delim, str) and delim in (",",";","\t","|"):
-        out.to_csv(out_path, index=False, sep=delim, encoding=out_enc)
-    else:
-        out.to_csv(out_path, index=False, encoding=out_enc)
+    sep = delim if isinstance(delim, str) and delim in DELIMITERS else ","
+    with open(out_path, "w", encoding=out_enc, newline="", buffering=1 << 20) as f:
+        out.to_csv(f, index=False, sep=sep, lineterminator="\n", quoting=csv.QUOTE_MINIMAL)
 
     print(f"Detected input encoding: {enc}; delimiter: {delim}")
     print(f"Wrote {out.shape[0]} rows to {out_path} with encoding: {out_enc}")
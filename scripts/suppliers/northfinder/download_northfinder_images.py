@@ -1,15 +1,26 @@
 import argparse
+import logging
 import os
 import re
-from urllib.parse import urlparse, urljoin
+import shutil
+import sys
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from html import unescape
 from io import BytesIO
+from pathlib import Path
+from urllib.parse import urlparse, urljoin
 
 import requests
-from bs4 import BeautifulSoup
 from PIL import Image
 import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import List, Optional, Set
 
+log = logging.getLogger(__name__)
+
 # ---------------------------------------
 # KONFIGURÁCIA SSL
 # ---------------------------------------
@@ -18,28 +29,73 @@ from typing import List, Optional, Set
 # DEFAULT: False => hneď "insecure" (verify=False)
 TRY_SECURE_FIRST = False
 
-IMAGE_EXTS = (".webp", ".jpg", ".jpeg", ".png")
+IMAGE_EXTS = frozenset({"webp", "jpg", "jpeg", "png"})
+NF_DOMAIN = "northfinder.com"
+
+# Koľko obrázkov jedného produktu sa sťahuje paralelne.
+MAX_WORKERS = 12
+
+# Koľko stiahnutých obrázkov môže naraz čakať na konverziu do PNG (strop pamäte).
+MAX_PENDING_IMAGES = 32
+
+# Režimy obrázka, ktoré PNG uloží bez konverzie.
+PNG_MODES = ("RGB", "RGBA", "L", "LA", "P")
+
+# zlib úroveň pre PNG (0–9): 1 = rýchle kódovanie za cenu o niečo väčších súborov
+PNG_COMPRESS_LEVEL = 1
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+_NF_IMG_RE = re.compile(
+    r"https://(?:b2b\.)?northfinder\.com/[^\s\"']+?\.(?:webp|jpg|jpeg|png)(?:\?[^\s\"']*)?",
+    re.IGNORECASE,
+)
+# href ako samostatný atribút (nie data-href), prvý v tagu; hodnota v "", '' alebo bez úvodzoviek.
+# Hodnoty ostatných atribútov sa preskakujú celé, aby '>' či "href=" v nich nič nepokazili.
+_HREF_RE = re.compile(
+    r"""<a\b(?:[^>"']|"[^"]*"|'[^']*')*?(?<![\w-])href\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>"']+))""",
+    re.IGNORECASE,
+)
 
 
 def make_session():
     session = requests.Session()
     session.headers.update({
-        "User-Agent": "Mozilla/5.0 (compatible; NorthfinderImageDownloader/1.0)"
+        "User-Agent": "Mozilla/5.0 (compatible; NorthfinderImageDownloader/1.0)",
+        # HTML príde gzip-om (requests ho rozbalí sám), obrázky sú už komprimované
+        "Accept-Encoding": "gzip, deflate",
+        "Accept": "text/html,image/webp,image/*;q=0.9,*/*;q=0.8",
+        "Connection": "keep-alive",
     })
+    # pool keep-alive spojení pre paralelné sťahovanie + retry pri výpadkoch
+    # (pool_connections = počet hostov: northfinder.com, b2b.northfinder.com, ...)
+    session.mount("https://", HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=32,
+        max_retries=Retry(total=3, backoff_factor=0.3,
+                          status_forcelist=[500, 502, 503, 504]),
+    ))
     # potlačíme warningy pre verify=False
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
     return session
 
 
-def fetch(session, url):
+def fetch(session, url, stream=False):
     """Načíta URL s ohľadom na TRY_SECURE_FIRST."""
     if TRY_SECURE_FIRST:
         try:
-            return session.get(url, timeout=20, verify=True)
+            return session.get(url, timeout=20, verify=True, stream=stream)
         except requests.exceptions.SSLError:
-            print("SSL chyba pri {}, idem bez verifikácie certifikátu...".format(url))
+            log.warning("SSL chyba pri %s, idem bez verifikácie certifikátu...", url)
     # default: insecure
-    return session.get(url, timeout=20, verify=False)
+    return session.get(url, timeout=20, verify=False, stream=stream)
+
+
+def fetch_html(session, url):
+    """Načíta HTML stránky (vyhodí výnimku pri HTTP chybe)."""
+    resp = fetch(session, url)
+    resp.raise_for_status()
+    return resp.text
 
 
 # ---------------------------------------
@@ -49,10 +105,12 @@ def fetch(session, url):
 def is_direct_image_url(url):
     """Vracia True, ak je to priamy obrázok na northfinder.com/b2b.northfinder.com."""
     p = urlparse(url)
-    if "northfinder.com" not in p.netloc:
+    host = p.hostname or ""
+    # northfinder.com alebo jeho subdoména (b2b.), nie napr. evilnorthfinder.com
+    if host != NF_DOMAIN and not host.endswith("." + NF_DOMAIN):
         return False
-    path_lower = p.path.lower()
-    return any(path_lower.endswith(ext) for ext in IMAGE_EXTS)
+    # p.path je bez query, takže ...webp?foo=1 sa rozpozná správne
+    return p.path.rpartition(".")[2].lower() in IMAGE_EXTS
 
 
 def derive_filter_from_product_url(url):
@@ -95,72 +153,49 @@ def derive_variant_tag(url):
 def extract_northfinder_image_urls(html):
     """
     Z HTML vytiahne všetky URL na obrázky z northfinder.com aj b2b.northfinder.com.
-    Hľadá .webp/.jpg/.jpeg/.png, zachováva poradie a odstraňuje duplicity.
+    Hľadá .webp/.jpg/.jpeg/.png, zachováva poradie a odstraňuje duplicity
+    (rovnaký obrázok s inou query sa berie ako duplicita). Vracia URL bez query.
     """
-    pattern = re.compile(
-        r"https://(?:b2b\.)?northfinder\.com/[^\s\"']+?\.(?:webp|jpg|jpeg|png)(?:\?[^\s\"']*)?",
-        re.IGNORECASE,
-    )
-    urls = []  # type: List[str]
-    seen = set()  # type: Set[str]
+    return list(dict.fromkeys(m.group(0).split("?", 1)[0] for m in _NF_IMG_RE.finditer(html)))
 
-    for m in pattern.finditer(html):
-        u = m.group(0)
-        if u not in seen:
-            seen.add(u)
-            urls.append(u)
-
-    return urls
 
-
-def filter_urls_by_substring(urls, substring):
-    """Ak je daný substring, nechá len URL, ktoré ho obsahujú."""
-    if not substring:
-        return urls
-    substring = substring.lower()
-    return [u for u in urls if substring in u.lower()]
-
-
-def prefer_b2b(urls):
-    """
-    Ak sú k dispozícii b2b.northfinder.com obrázky, použije iba tie.
-    Inak vráti pôvodný zoznam.
-    """
-    b2b = [u for u in urls if "b2b.northfinder.com" in u]
-    return b2b if b2b else urls
-
-
-def prefer_original_default(urls):
+def select_image_urls(urls, substring):
     """
-    Ak sú k dispozícii original_default verzie, použije iba tie.
-    Inak vráti pôvodný zoznam.
+    Nechá len URL obsahujúce substring (ak je zadaný), z nich preferuje
+    b2b a potom original_default verzie. Zoznam prejde iba raz.
     """
-    originals = [u for u in urls if "original_default" in u]
-    return originals if originals else urls
+    sub = (substring or "").lower()
+    matched, matched_orig, matched_b2b, matched_b2b_orig = [], [], [], []
+    for u in urls:
+        if sub and sub not in u.lower():
+            continue
+        is_orig = "original_default" in u
+        matched.append(u)
+        if is_orig:
+            matched_orig.append(u)
+        if "b2b.northfinder.com" in u:
+            matched_b2b.append(u)
+            if is_orig:
+                matched_b2b_orig.append(u)
+    if matched_b2b:
+        return matched_b2b_orig or matched_b2b
+    return matched_orig or matched
 
 
 # ---------------------------------------
 # Ukladanie obrázkov
 # ---------------------------------------
 
-def convert_and_save_png(session,
-                         url,
-                         out_dir,
-                         index=None,
-                         variant_tag=None):
+def image_out_path(url, out_dir, index=None, variant_tag=None):
     """
-    Stiahne obrázok, skonvertuje do PNG a uloží s unikátnym názvom.
+    Vráti cestu pre obrázok: <variant_tag>_<index>_<názov>.png
+    v priečinku out_dir (pathlib.Path).
     """
-    download_url = url
-    base_url = url.split("?", 1)[0]
-
-    resp = fetch(session, download_url)
-    resp.raise_for_status()
-
-    img = Image.open(BytesIO(resp.content)).convert("RGBA")
-
-    filename = os.path.basename(urlparse(base_url).path)
-    name_no_ext, _ = os.path.splitext(filename)
+    # posledný segment cesty bez query/fragmentu
+    filename = url.split("?", 1)[0].split("#", 1)[0].rpartition("/")[2]
+    name_no_ext, dot, _ = filename.rpartition(".")
+    if not dot:
+        name_no_ext = filename
 
     parts = []
     if variant_tag:
@@ -169,18 +204,68 @@ def convert_and_save_png(session,
         parts.append("{:02d}".format(index))
     parts.append(name_no_ext)
 
-    out_filename = "_".join(parts) + ".png"
-    out_path = os.path.join(out_dir, out_filename)
+    return out_dir / ("_".join(parts) + ".png")
 
-    img.save(out_path, format="PNG")
-    print("✓ Uložené: {}".format(out_path))
 
+@contextmanager
+def atomic_output(out_path):
+    """
+    Vráti dočasnú cestu vedľa out_path; po úspešnom zápise ju presunie na
+    out_path, pri chybe ju zmaže. Nedokončený súbor tak nikdy nezostane
+    pod finálnym názvom (a nebol by neskôr preskočený ako „už existuje“).
+    """
+    tmp_path = out_path.with_suffix(".part")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        try:
+            tmp_path.unlink()
+        except FileNotFoundError:
+            pass
+        raise
 
-def handle_direct_image_url(session, url, out_dir):
-    """Ak je vstup už priamo obrázok, stiahne a skonvertuje jeden PNG."""
-    if not os.path.isdir(out_dir):
-        os.makedirs(out_dir)
-    convert_and_save_png(session, url, out_dir, index=1, variant_tag=None)
+
+def download_image(session, url, out_path):
+    """
+    Stiahne obrázok. Ak je zdroj už PNG, zapíše ho rovno do out_path
+    a vráti None; inak vráti stiahnuté bajty na konverziu.
+    """
+    # stream=True: PNG ide priamo do súboru, nie cez bytes v pamäti
+    with fetch(session, url, stream=True) as resp:
+        resp.raise_for_status()
+        resp.raw.decode_content = True
+
+        # bez konverzie sa zapíše len to, čo je naozaj PNG (Content-Type alebo
+        # signatúra); ostatné ide do encode_png, ktorý ne-obrázok odmietne
+        content_type = resp.headers.get("Content-Type", "").split(";", 1)[0].strip().lower()
+        head = resp.raw.read(len(PNG_SIGNATURE))
+        if content_type != "image/png" and head != PNG_SIGNATURE:
+            return head + resp.raw.read()
+
+        with atomic_output(out_path) as tmp_path, open(tmp_path, "wb") as f:
+            f.write(head)
+            shutil.copyfileobj(resp.raw, f, length=64 * 1024)
+        return None
+
+
+def encode_png(data, out_path):
+    """Dekóduje stiahnutý obrázok a uloží ho ako PNG (CPU časť)."""
+    img = Image.open(BytesIO(data))
+    # PNG uloží tieto režimy priamo; ostatné (CMYK, YCbCr, PA...) sa prevedú,
+    # pričom alfa kanál sa ponechá len tam, kde ho zdroj má
+    if img.mode not in PNG_MODES:
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    with atomic_output(out_path) as tmp_path:
+        img.save(tmp_path, format="PNG", optimize=False, compress_level=PNG_COMPRESS_LEVEL)
+
+
+def handle_direct_image_url(session, url, out_dir, overwrite=False):
+    """
+    Ak je vstup už priamo obrázok, stiahne a skonvertuje jeden PNG.
+    Vráti počet chýb (0 alebo 1).
+    """
+    return download_images(session, [(url, 1, None)], out_dir, overwrite=overwrite)
 
 
 # ---------------------------------------
@@ -202,8 +287,6 @@ def find_variant_urls(html, base_url_no_query):
     else:
         base_html_path = base_path
 
-    soup = BeautifulSoup(html, "html.parser")
-
     urls = []  # type: List[str]
     seen = set()  # type: Set[str]
 
@@ -215,57 +298,136 @@ def find_variant_urls(html, base_url_no_query):
 
     add_url(base_url_no_query)
 
-    for a in soup.find_all("a", href=True):
-        full = urljoin(base_url_no_query, a["href"])
-        p = urlparse(full)
-        if p.netloc != base_netloc:
+    # stačia href-y z <a> tagov, DOM netreba stavať
+    for m in _HREF_RE.finditer(html):
+        href = unescape(m.group(1) or m.group(2) or m.group(3) or "").split("#", 1)[0]
+        if not href:
             continue
-        if base_html_path not in p.path:
+        full = urljoin(base_url_no_query, href)
+        if href.startswith("/") and not href.startswith("//"):
+            # relatívny odkaz => rovnaký host, netreba celý urlparse
+            path = href.split("#", 1)[0].split("?", 1)[0]
+        else:
+            p = urlparse(full)
+            if p.netloc != base_netloc:
+                continue
+            path = p.path
+        if base_html_path not in path:
             continue
         add_url(full)
 
     return urls
 
 
-def process_product_page(session,
-                         product_url,
-                         filter_str,
-                         out_dir):
+def product_image_jobs(product_url, html, filter_str, seen=None):
     """
-    Stiahne HTML produktovej stránky, vytiahne obrázky,
-    prefiltuje a uloží ich ako PNG.
+    Z HTML produktovej stránky vytiahne a prefiltruje obrázky.
+    Vráti zoznam úloh (img_url, index, variant_tag) na stiahnutie.
+    Ak je zadaná množina seen, preskočí obrázky, ktoré už v nej sú
+    (zdieľané medzi variantmi), a nové do nej pridá.
     """
-    print("\nNačítavam produkt: {}".format(product_url))
-    resp = fetch(session, product_url)
-    resp.raise_for_status()
-    html = resp.text
-
     all_img_urls = extract_northfinder_image_urls(html)
     if not all_img_urls:
-        print("  – Nenašli sa žiadne obrázky northfinder.com v HTML.")
-        return
+        log.info("  – Nenašli sa žiadne obrázky northfinder.com v HTML.")
+        return []
 
-    filtered_urls = filter_urls_by_substring(all_img_urls, filter_str)
+    filtered_urls = select_image_urls(all_img_urls, filter_str)
     if not filtered_urls:
-        print("  – Nenašli sa obrázky zodpovedajúce filtru '{}'.".format(filter_str))
-        return
+        log.info("  – Nenašli sa obrázky zodpovedajúce filtru '%s'.", filter_str)
+        return []
 
-    # najprv preferuj b2b, až potom original_default
-    filtered_urls = prefer_b2b(filtered_urls)
-    filtered_urls = prefer_original_default(filtered_urls)
+    skipped = 0
+    if seen is not None:
+        fresh = [u for u in filtered_urls if u.split("?", 1)[0] not in seen]
+        seen.update(u.split("?", 1)[0] for u in fresh)
+        skipped = len(filtered_urls) - len(fresh)
+        filtered_urls = fresh
 
     variant_tag = derive_variant_tag(product_url)
     if variant_tag:
-        print("  Variant: {}, obrázkov: {}".format(variant_tag, len(filtered_urls)))
+        log.info("  Variant: %s, obrázkov: %s", variant_tag, len(filtered_urls))
     else:
-        print("  Variant: (bez tagu), obrázkov: {}".format(len(filtered_urls)))
+        log.info("  Variant: (bez tagu), obrázkov: %s", len(filtered_urls))
+    if skipped:
+        log.info("  – Preskočené (už stiahnuté pri inom variante): %s", skipped)
+
+    return [(img_url, idx, variant_tag)
+            for idx, img_url in enumerate(filtered_urls, start=1)]
+
 
-    for idx, img_url in enumerate(filtered_urls, start=1):
+def download_images(session, jobs, out_dir, overwrite=False):
+    """
+    Paralelne stiahne a uloží obrázky zo zoznamu úloh (img_url, index, variant_tag).
+    Sťahovanie beží v I/O poole (MAX_WORKERS vlákien), dekódovanie a PNG
+    kódovanie v menšom CPU poole; MAX_PENDING_IMAGES obmedzuje, koľko
+    stiahnutých a ešte neuložených obrázkov môže byť naraz v pamäti.
+    Chyby jednotlivých obrázkov sa zalogujú; vráti ich počet.
+    """
+    slots = threading.BoundedSemaphore(MAX_PENDING_IMAGES)
+
+    def encode_stage(data, out_path):
         try:
-            convert_and_save_png(session, img_url, out_dir,
-                                 index=idx, variant_tag=variant_tag)
-        except Exception as e:
-            print("✗ Chyba pri {}: {}".format(img_url, e))
+            encode_png(data, out_path)
+        finally:
+            slots.release()
+        log.info("✓ Uložené: %s", out_path)
+
+    def download_stage(img_url, idx, variant_tag):
+        out_path = image_out_path(img_url, out_dir, index=idx, variant_tag=variant_tag)
+        if not overwrite and out_path.exists():
+            log.info("• Už existuje, preskakujem: %s", out_path)
+            return None
+        slots.acquire()
+        try:
+            data = download_image(session, img_url, out_path)
+        except BaseException:
+            slots.release()
+            raise
+        if data is None:
+            slots.release()
+            log.info("✓ Uložené: %s", out_path)
+            return None
+        return cpu_pool.submit(encode_stage, data, out_path)
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as cpu_pool:
+        encodes = {}
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as io_pool:
+            downloads = {
+                io_pool.submit(download_stage, img_url, idx, variant_tag): img_url
+                for img_url, idx, variant_tag in jobs
+            }
+            for f in as_completed(downloads):
+                try:
+                    encode = f.result()
+                except Exception as e:
+                    log.error("✗ Chyba pri %s: %s", downloads[f], e)
+                    failed += 1
+                    continue
+                if encode is not None:
+                    encodes[encode] = downloads[f]
+        for f in as_completed(encodes):
+            try:
+                f.result()
+            except Exception as e:
+                log.error("✗ Chyba pri %s: %s", encodes[f], e)
+                failed += 1
+    return failed
+
+
+def process_product_page(session,
+                         product_url,
+                         filter_str,
+                         out_dir,
+                         overwrite=False):
+    """
+    Stiahne HTML produktovej stránky, vytiahne obrázky,
+    prefiltuje a uloží ich ako PNG. Vráti počet obrázkov, ktoré zlyhali.
+    """
+    log.info("\nNačítavam produkt: %s", product_url)
+    html = fetch_html(session, product_url)
+    return download_images(session, product_image_jobs(product_url, html, filter_str), out_dir,
+                           overwrite=overwrite)
 
 
 # ---------------------------------------
@@ -302,8 +464,15 @@ def main():
         help="Ak je zadané, pokúsi sa nájsť aj ostatné farebné varianty a stiahnuť "
              "obrázky zo všetkých.",
     )
+    parser.add_argument(
+        "--force",
+        dest="overwrite",
+        action="store_true",
+        help="Stiahne a prepíše aj obrázky, ktoré už v cieľovom priečinku existujú.",
+    )
 
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
 
     raw_url = args.url.strip()
     url_no_query = raw_url.split("?", 1)[0]
@@ -312,9 +481,11 @@ def main():
 
     # 1) Priama URL na obrázok (northfinder alebo b2b)
     if is_direct_image_url(raw_url):
-        out_dir = args.out_dir or "images_direct"
-        print("Zistená priama image URL, sťahujem jeden obrázok do '{}' (PNG).".format(out_dir))
-        handle_direct_image_url(session, raw_url, out_dir)
+        out_dir = Path(args.out_dir or "images_direct")
+        out_dir.mkdir(parents=True, exist_ok=True)
+        log.info("Zistená priama image URL, sťahujem jeden obrázok do '%s' (PNG).", out_dir)
+        if handle_direct_image_url(session, raw_url, out_dir, overwrite=args.overwrite):
+            sys.exit(1)
         return
 
     # 2) Produktová stránka na northfinder.com (aj s ?search_query)
@@ -322,37 +493,57 @@ def main():
     if not filter_str:
         filter_str = derive_filter_from_product_url(url_no_query)
         if filter_str:
-            print("Automaticky zvolený filter podľa URL: '{}'".format(filter_str))
+            log.info("Automaticky zvolený filter podľa URL: '%s'", filter_str)
         else:
-            print("Filter z URL sa nepodarilo odvodiť, použijú sa všetky nájdené obrázky.")
+            log.info("Filter z URL sa nepodarilo odvodiť, použijú sa všetky nájdené obrázky.")
 
     if args.out_dir:
-        out_dir = args.out_dir
+        out_dir = Path(args.out_dir)
     else:
         if filter_str:
-            out_dir = "images_{}".format(filter_str)
+            out_dir = Path("images_{}".format(filter_str))
         else:
-            out_dir = "images"
+            out_dir = Path("images")
 
-    if not os.path.isdir(out_dir):
-        os.makedirs(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
 
     # Bez variantov – spracujeme len danú URL (vrátane query)
     if not args.all_variants:
-        process_product_page(session, raw_url, filter_str, out_dir)
+        if process_product_page(session, raw_url, filter_str, out_dir, overwrite=args.overwrite):
+            sys.exit(1)
         return
 
     # all-variants mód – načítame HTML a hľadáme ostatné varianty (bez query)
-    print("Načítavam stránku (pre hľadanie variantov): {}".format(raw_url))
-    resp = fetch(session, raw_url)
-    resp.raise_for_status()
-    html = resp.text
+    log.info("Načítavam stránku (pre hľadanie variantov): %s", raw_url)
+    html = fetch_html(session, raw_url)
 
     variant_urls = find_variant_urls(html, url_no_query)
-    print("Našiel som {} variantov produktu (vrátane aktuálneho).".format(len(variant_urls)))
-
-    for v_url in variant_urls:
-        process_product_page(session, v_url, filter_str, out_dir)
+    log.info("Našiel som %s variantov produktu (vrátane aktuálneho).", len(variant_urls))
+
+    # HTML všetkých variantov načítame naraz, obrázky potom v jednom spoločnom poole
+    # (chyba jedného variantu nezastaví ostatné)
+    pages = {}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        futures = {ex.submit(fetch_html, session, u): u for u in variant_urls}
+        for f in as_completed(futures):
+            try:
+                pages[futures[f]] = f.result()
+            except Exception as e:
+                log.error("✗ Chyba pri %s: %s", futures[f], e)
+
+    jobs = []
+    seen_imgs = set()  # type: Set[str]
+    for v_url in variant_urls:  # pôvodné poradie => stabilné číslovanie a dedup
+        if v_url not in pages:
+            continue
+        log.info("\nProdukt: %s", v_url)
+        jobs.extend(product_image_jobs(v_url, pages[v_url], filter_str, seen=seen_imgs))
+
+    # nenačítané varianty aj neuložené obrázky => nenulový exit code
+    failed = len(variant_urls) - len(pages)
+    failed += download_images(session, jobs, out_dir, overwrite=args.overwrite)
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":